@@ -0,0 +1,192 @@
+# Copyright (c) 2022 Filippo Argiolas <filippo.argiolas@ca.infn.it>.
+#
+# a simple script to download timeseries data from ThingsBoard
+# barely tested, poor error checking, ugly code, use at your own risk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""On-disk caches of downloaded timeseries chunks and metadata."""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# schema metadata listing the columns split by `_split_mixed`
+_MIXED = b'tb_download.mixed'
+
+
+def _split_mixed(df):
+    """Split columns mixing numbers and text (long format values).
+
+    Parquet columns have a single type: numbers are kept in the column
+    as floats, text goes in a `<column>.text` one.
+
+    :return: the split dataframe and the float type of each split column
+    """
+    mixed = {}
+    for c in list(df.columns):
+        values = df[c].to_numpy()
+        if values.dtype != object:
+            continue
+        text = np.array([isinstance(v, str) for v in values], dtype=bool)
+        numbers = values[~text & ~pd.isna(values)]
+        if not len(numbers):
+            continue
+        mixed[c] = 'float32' if any(isinstance(v, np.float32) for v in numbers) else 'float64'
+        df = df.assign(**{c: np.where(text, np.nan, values).astype(np.float64),
+                          f'{c}.text': np.where(text, values, None)})
+    return df, mixed
+
+
+def _join_mixed(df, mixed):
+    """Join back columns split by `_split_mixed`."""
+    for c, dtype in mixed.items():
+        text = df.pop(f'{c}.text').to_numpy()
+        # numbers of the original type, not python floats
+        values = np.array(list(df[c].to_numpy().astype(dtype)), dtype=object)
+        has_text = ~pd.isna(text)
+        values[has_text] = text[has_text]
+        df[c] = values
+    return df
+
+
+def default_cache_dir():
+    """Per-user cache directory, honoring XDG_CACHE_HOME."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'tb-download')
+
+
+class ChunkCache(object):
+    """On-disk cache of downloaded timeseries chunks.
+
+    Chunks are stored as zstd compressed Parquet files named after a
+    hash of the request parameters, so running again a download (or
+    resuming an interrupted one) doesn't fetch the data we already
+    have. Empty chunks are cached too. Needs pyarrow.
+
+    :param directory: cache directory, created if missing
+    """
+
+    def __init__(self, directory):
+        """Initialize class arguments and create the cache directory."""
+        if pq is None:
+            raise ImportError("pyarrow is needed to cache downloaded data")
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, params):
+        key = hashlib.sha1(':'.join(str(p) for p in params).encode()).hexdigest()
+        return os.path.join(self.directory, f'{key}.parquet')
+
+    def load(self, params):
+        """Load a cached chunk.
+
+        :param params: tuple of request parameters identifying the chunk
+        :return: the cached dataframe, None for an empty chunk
+        :raises KeyError: if the chunk is not in the cache
+        """
+        path = self._path(params)
+        try:
+            df = pd.read_parquet(path)
+        except FileNotFoundError:
+            raise KeyError(params)
+        metadata = pq.read_schema(path).metadata or {}
+        if _MIXED in metadata:
+            df = _join_mixed(df, json.loads(metadata[_MIXED]))
+        return None if df.empty else df
+
+    def store(self, params, df):
+        """Store a chunk in the cache.
+
+        :param params: tuple of request parameters identifying the chunk
+        :param df: downloaded dataframe, None for an empty chunk
+        """
+        path = self._path(params)
+        # write to a temporary file first so concurrent downloads never
+        # see a partially written chunk
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        df, mixed = _split_mixed(pd.DataFrame() if df is None else df)
+        table = pa.Table.from_pandas(df)
+        if mixed:
+            table = table.replace_schema_metadata({**table.schema.metadata, _MIXED: json.dumps(mixed)})
+        pq.write_table(table, tmp, compression='zstd')
+        os.replace(tmp, path)
+
+
+class MetadataCache(object):
+    """On-disk cache of small json metadata (e.g. device lists and keys).
+
+    Entries expire after `ttl` seconds. The whole cache is a single
+    json file, rewritten on every change: metadata is tiny and only
+    changes a few times per run.
+
+    :param filename: cache file, created if missing
+    :param ttl: seconds after which entries are fetched again
+    """
+
+    def __init__(self, filename, ttl=3600):
+        """Initialize class arguments and load the cache file."""
+        self.filename = filename
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        try:
+            with open(filename) as fp:
+                self.entries = json.load(fp)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, key):
+        """Get a cached value.
+
+        :param key: entry name
+        :raises KeyError: if the entry is missing or expired
+        """
+        stored, value = self.entries[key]
+        if time.time() - stored > self.ttl:
+            raise KeyError(key)
+        return value
+
+    def set(self, key, value):
+        """Cache a json serializable value.
+
+        :param key: entry name
+        :param value: value to cache
+        """
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self._save()
+
+    def clear(self):
+        """Drop every entry."""
+        with self.lock:
+            self.entries = {}
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        tmp = f'{self.filename}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(self.entries, fp)
+        os.replace(tmp, self.filename)
@@ -18,12 +18,97 @@
 #
 """A minimal set of bindings to download data from ThingsBoard."""
 
+import os
 import sys
+import json
+import time
+import array
+import base64
+import threading
+import functools
+import itertools
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from urllib3.util import Retry, make_headers
+import numpy as np
 import pandas as pd
 
 from .util import print_exception
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# retried with exponential backoff by both http backends
+_retry_statuses = (429, 500, 502, 503, 504)
+
+# errors raised by either http backend
+if httpx is not None:
+    _http_errors = (requests.exceptions.RequestException, httpx.HTTPError)
+else:
+    _http_errors = (requests.exceptions.RequestException,)
+
+
+def _jwt_expiry(token):
+    """Return JWT expiration time in seconds since epoch, None if unknown.
+
+    The payload is only decoded, not verified, the server still does
+    that: we just want to know when it's time to refresh.
+    """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))['exp']
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _as_text(values):
+    """Return raw json values as an object array of strings, null is missing."""
+    return np.array([None if v is None else str(v) for v in values], dtype=object)
+
+
+# how the streaming parser writes a parsed number back as text
+_MISSING, _REPR, _INTEGER, _RAW = range(4)
+
+
+def _number_form(value, number):
+    if value is None:
+        return _MISSING
+    text = str(value)
+    if text == repr(number):
+        return _REPR
+    if number.is_integer() and text == str(int(number)):
+        return _INTEGER
+    return _RAW
+
+
+def _unparse(numbers, forms, raw):
+    """Rebuild the raw text of numbers parsed by `_parse_timeseries`."""
+    text = []
+    for i, (number, form) in enumerate(zip(numbers, forms)):
+        if form == _MISSING:
+            text.append(None)
+        elif form == _REPR:
+            text.append(repr(number))
+        elif form == _INTEGER:
+            text.append(str(int(number)))
+        else:
+            text.append(raw[i])
+    return text
+
 
 class TBDownload(object):
     """Minimal client to download timeseries data from a ThingsBoard instance.
@@ -45,69 +130,233 @@ class TBDownload(object):
     :param public_id: CustomerId of the Public user, from the public dashboard url
     :param username: Customer or Tenant username
     :param password: Customer or Tenant password
+    :param pool_maxsize: maximum number of pooled connections to keep alive
+    :param timeout: seconds to wait for the server before retrying a request
+    :param stream_json: stream-parse timeseries responses (needs ijson),
+                        slower but uses way less memory on large payloads
+    :param http2: use an httpx HTTP/2 client, concurrent requests are
+                  multiplexed on a single connection (needs httpx with
+                  the http2 extra). Not compatible with stream_json
+    :param session_file: save auth tokens here and reuse them at next
+                         login instead of logging in again, None to
+                         always log in
+    :param metadata: `tb_download.cache.MetadataCache` keeping device lists
+                     and keys across runs, None to only cache them in memory
 
     Note: if both public_id and credentials are provided public_id is
     preferred and credentials are silently ignored.
 
     """
 
-    def __init__(self, url, public_id=None, username=None, password=None):
+    def __init__(self, url, public_id=None, username=None, password=None, pool_maxsize=10, timeout=60,
+                 stream_json=False, http2=False, session_file=None, metadata=None):
         """Initialize class arguments."""
         self.url = url
+        # every endpoint lives under these, joined once here
+        self.api_url = f'{url}/api'
+        self.telemetry_url = f'{self.api_url}/plugins/telemetry'
         self.public_id = public_id
         self.username = username
         self.password = password
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self.stream_json = stream_json
+        self.session_file = session_file
+        self.http2 = http2
+        self.metadata = metadata
+
+        # metadata fetched by this client, see `_memoized`
+        self.memo = {}
+
+        # tokens are refreshed lazily, right before they expire
+        self.token_exp = None
+        self.token_lock = threading.RLock()
+
+        if http2:
+            if httpx is None:
+                raise ImportError("httpx is needed for HTTP/2 support")
+            if stream_json:
+                raise ValueError("stream_json is not supported with HTTP/2")
+            # the transport only retries failed connections, statuses
+            # are retried by `_send`. httpx decodes every encoding it
+            # supports out of the box
+            limits = httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize)
+            transport = httpx.HTTPTransport(http2=True, limits=limits, retries=5)
+            self.session = httpx.Client(transport=transport)
+            return
+
+        # a single keep-alive session shared by every request (and
+        # thread) so we don't pay a new TCP+TLS handshake each time.
+        # Transient server errors and rate limiting are retried with
+        # exponential backoff (or as told by Retry-After) instead of
+        # failing the whole download
+        self.session = requests.Session()
+        retries = Retry(total=5, backoff_factor=0.5,
+                        status_forcelist=_retry_statuses)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize,
+                                                max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # telemetry json is very repetitive and compresses really well,
+        # advertise every encoding urllib3 can decode (brotli and zstd
+        # too, if the optional modules are installed)
+        self.session.headers['Accept-Encoding'] = make_headers(accept_encoding=True)['accept-encoding']
+
+    def close(self):
+        """Close pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        """Use the client as a context manager, closing it on exit."""
+        return self
+
+    def __exit__(self, *exc):
+        """Close the client."""
+        self.close()
+
+    # urllib3 retries failed statuses for requests, httpx doesn't: back
+    # off and retry here like urllib3 would, honoring Retry-After
+    def _send(self, send, *args, **kwargs):
+        r = send(*args, **kwargs)
+        if not self.http2:
+            return r
+
+        for attempt in range(5):
+            if r.status_code not in _retry_statuses:
+                break
+            try:
+                delay = float(r.headers['Retry-After'])
+            except (KeyError, ValueError):
+                delay = 0.5 * 2 ** attempt
+            time.sleep(delay)
+            r = send(*args, **kwargs)
+
+        return r
 
     # poor error handling but useful for debugging: raise fatal
-    # exceptions for every error, including http ones
+    # exceptions for every error, including http ones (after retries).
+    # Always set a timeout so a stalled connection is retried too
     def _get(self, *args, **kwargs):
+        self._check_token()
+        kwargs.setdefault('timeout', self.timeout)
         try:
-            r = requests.get(*args, **kwargs)
+            r = self._send(self.session.get, *args, **kwargs)
             r.raise_for_status()
             return r
-        except requests.exceptions.RequestException:
+        except _http_errors:
             print_exception()
             sys.exit(1)
 
     def _post(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
         try:
-            r = requests.post(*args, **kwargs)
+            r = self._send(self.session.post, *args, **kwargs)
             r.raise_for_status()
             return r
-        except requests.exceptions.RequestException:
+        except _http_errors:
             print_exception()
             sys.exit(1)
 
-    def login(self):
-        """Login with credentials provided at init."""
+    # decode every response with orjson when available, it's way
+    # faster than the stdlib json module (timeseries payloads can be
+    # several MB)
+    def _json(self, r):
+        if orjson is not None:
+            return orjson.loads(r.content)
+        return r.json()
+
+    # refresh the token a minute before it expires instead of failing
+    # halfway through a long download, log in again if the refresh
+    # token is gone too
+    def _check_token(self):
+        if self.token_exp is None or time.time() < self.token_exp - 60:
+            return
+        with self.token_lock:
+            if time.time() < self.token_exp - 60:
+                return
+            refresh_exp = _jwt_expiry(self.refresh_token)
+            if refresh_exp is not None and time.time() >= refresh_exp - 60:
+                self.login(reuse_session=False)
+            else:
+                self.refresh()
+
+    def _set_tokens(self, tokens):
+        self.token = tokens['token']
+        self.refresh_token = tokens['refreshToken']
+        self.token_exp = _jwt_expiry(self.token)
+        self.auth_headers = {'X-Authorization': f'Bearer {self.token}'}
+        # sent with every request from now on
+        self.session.headers.update(self.auth_headers)
+
+    def _save_session(self):
+        if not self.session_file:
+            return
+        os.makedirs(os.path.dirname(self.session_file) or '.', exist_ok=True)
+        # tokens are as good as a password until they expire, keep
+        # them private
+        fd = os.open(self.session_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w') as fp:
+            json.dump({'token': self.token,
+                       'refreshToken': self.refresh_token,
+                       'authority': self.user_authority,
+                       'userId': self.user_id}, fp)
+
+    def _load_session(self):
+        try:
+            with open(self.session_file) as fp:
+                saved = json.load(fp)
+            tokens = {'token': saved['token'], 'refreshToken': saved['refreshToken']}
+            self.user_authority = saved['authority']
+            self.user_id = saved['userId']
+        except (OSError, KeyError, TypeError, ValueError):
+            return False
+
+        # still good if either token can be used
+        now = time.time()
+        expiry = [_jwt_expiry(tokens['token']), _jwt_expiry(tokens['refreshToken'])]
+        if not any(exp is not None and now < exp - 60 for exp in expiry):
+            return False
+
+        self._set_tokens(tokens)
+        return True
+
+    def login(self, reuse_session=True):
+        """Login with credentials provided at init.
+
+        :param reuse_session: reuse tokens saved in `session_file`, if
+                              any, instead of logging in again
+        """
+        if reuse_session and self.session_file and self._load_session():
+            # refreshed on first request if expired
+            return
+
         if self.public_id:
-            r = self._post(f'{self.url}/api/auth/login/public',
+            r = self._post(f'{self.api_url}/auth/login/public',
                            json={'publicId': self.public_id})
         else:
-            r = self._post(f'{self.url}/api/auth/login',
+            r = self._post(f'{self.api_url}/auth/login',
                            json={'username': self.username,
                                  'password': self.password})
 
-        self.token = r.json()['token']
-        self.refresh_token = r.json()['refreshToken']
-        self.auth_headers = {'X-Authorization': f'Bearer {self.token}'}
+        self._set_tokens(self._json(r))
 
         if self.public_id:
             self.user_authority = "CUSTOMER"
             self.user_id = self.public_id
         else:
-            r = self._get(f'{self.url}/api/auth/user',
-                          headers=self.auth_headers)
-            self.user_authority = r.json()['authority']
-            self.user_id = r.json()['customerId']['id']
+            user = self._json(self._get(f'{self.api_url}/auth/user'))
+            self.user_authority = user['authority']
+            self.user_id = user['customerId']['id']
+
+        self._save_session()
 
     def refresh(self):
         """Refresh session."""
-        r = self._post(f'{self.url}/api/auth/token',
+        r = self._post(f'{self.api_url}/auth/token',
                        json={'refreshToken': self.refresh_token})
-        self.token = r.json()['token']
-        self.refresh_token = r.json()['refreshToken']
-        self.auth_headers = {'X-Authorization': f'Bearer {self.token}'}
+        self._set_tokens(self._json(r))
+        self._save_session()
 
     def get_assets(self, page_size=20, page=0):
         """Enumerate assets available for current user.
@@ -115,51 +364,116 @@ class TBDownload(object):
         :param page_size: assets per page
         :param page: current page
         """
+        key = f'assets/{self.user_id}/{page_size}/{page}'
+        return self._cached_metadata(key, functools.partial(self._fetch_assets, page_size, page))
+
+    def _fetch_assets(self, page_size, page):
         if self.user_authority == "TENANT_ADMIN":
-            r = self._get(f'{self.url}/api/tenant/assets',
-                          headers=self.auth_headers,
+            r = self._get(f'{self.api_url}/tenant/assets',
                           params={'pageSize': page_size, 'page': page})
 
         else:
-            r = self._get(f'{self.url}/api/customer/{self.user_id}/assets',
-                          headers=self.auth_headers,
+            r = self._get(f'{self.api_url}/customer/{self.user_id}/assets',
                           params={'pageSize': page_size, 'page': page})
 
-        return r.json()
+        return self._json(r)
 
-    def get_asset_devices(self, asset):
-        """Enumerate devices contained in selected asset.
+    def get_asset_relations(self, asset):
+        """Enumerate entities contained in selected asset without fetching them.
+
+        Relation infos carry id and name of the related entity, enough
+        to list devices or query their attributes.
 
         :param asset: asset as returned by `get_assets()`
         """
         entity_id = asset['id']['id']
         entity_type = asset['id']['entityType']
 
-        r = self._get(f'{self.url}/api/relations',
-                      headers=self.auth_headers,
+        r = self._get(f'{self.api_url}/relations/info',
                       params={'fromId': entity_id,
                               'fromType': entity_type,
                               'relationType': 'Contains'})
-        relations = r.json()
+        return self._json(r)
 
-        devs = []
-        for rel in relations:
-            to_id = rel['to']['id']
-            r = self._get(f'{self.url}/api/device/{to_id}',
-                          headers=self.auth_headers)
+    def get_asset_devices(self, asset, name_filter=None):
+        """Enumerate devices contained in selected asset.
 
-            devs.append(r.json())
+        :param asset: asset as returned by `get_assets()`
+        :param name_filter: only return devices whose name contains this
+                            string, other devices are not even fetched
+        """
+        relations = self.get_asset_relations(asset)
+
+        if name_filter:
+            relations = [rel for rel in relations if name_filter in rel['toName']]
+
+        device_ids = [rel['to']['id'] for rel in relations]
+
+        # a single device (e.g. with a name filter) isn't worth a pool
+        if len(device_ids) <= 1:
+            return [self.get_device(device_id) for device_id in device_ids]
+
+        # fetch devices concurrently, as many as the connection pool
+        # can handle but no more threads than devices
+        with ThreadPoolExecutor(max_workers=min(self.pool_maxsize, len(device_ids))) as executor:
+            devs = list(executor.map(self.get_device, device_ids))
 
         return devs
 
+    # the same device can be related to more than one asset, only
+    # fetch it once
+    def get_device(self, device_id):
+        """Get device details by id.
+
+        :param device_id: device uuid
+        """
+        def fetch():
+            r = self._get(f'{self.api_url}/device/{device_id}')
+            return self._json(r)
+
+        return self._memoized(f'device/{device_id}', fetch)
+
+    def _telemetry_url(self, entity_type, entity_id, endpoint):
+        return f'{self.telemetry_url}/{entity_type}/{entity_id}/{endpoint}'
+
     def query_attributes(self, device, attributes=''):
         """Query attributes from a device."""
         entity_id = device['id']['id']
         entity_type = device['id']['entityType']
-        r = self._get(f'{self.url}/api/plugins/telemetry/{entity_type}/{entity_id}/values/attributes',
-                      params={'keys': ','.join(attributes)},
-                      headers=self.auth_headers)
-        return r.json()
+        r = self._get(self._telemetry_url(entity_type, entity_id, 'values/attributes'),
+                      params={'keys': ','.join(attributes)})
+        return self._json(r)
+
+    def _memoized(self, key, fetch):
+        # kept in a dict of this client rather than in a method lru_cache,
+        # which is shared by (and keeps alive) every client instance
+        try:
+            return self.memo[key]
+        except KeyError:
+            value = self.memo[key] = fetch()
+            return value
+
+    def _cached_metadata(self, key, fetch):
+        def load():
+            # look into the persistent cache first, if any
+            if self.metadata is not None:
+                try:
+                    return self.metadata.get(key)
+                except KeyError:
+                    pass
+
+            value = fetch()
+            if self.metadata is not None:
+                self.metadata.set(key, value)
+            return value
+
+        return self._memoized(key, load)
+
+    def clear_metadata_cache(self):
+        """Forget cached devices, device and asset lists and keys, in memory and on disk."""
+        self.memo.clear()
+        if self.metadata is not None:
+            self.metadata.clear()
 
     def get_devices(self, page_size=30, page=0, text_search=""):
         """Enumerate devices.
@@ -170,61 +484,182 @@ class TBDownload(object):
         :params page: current page
         :text_search: filter devices by name
         """
+        key = f'devices/{self.user_id}/{page_size}/{page}/{text_search}'
+        return self._cached_metadata(key, functools.partial(self._fetch_devices, page_size, page, text_search))
+
+    def _fetch_devices(self, page_size, page, text_search):
         if self.user_authority == "TENANT_ADMIN":
-            r = self._get(f'{self.url}/api/tenant/devices',
-                          headers=self.auth_headers,
+            r = self._get(f'{self.api_url}/tenant/devices',
                           params={'pageSize': page_size, 'page': page,
                                   'textSearch': text_search})
         else:
-            r = self._get(f'{self.url}/api/customer/{self.user_id}/devices',
-                          headers=self.auth_headers,
+            r = self._get(f'{self.api_url}/customer/{self.user_id}/devices',
                           params={'pageSize': page_size, 'page': page,
                                   'textSearch': text_search})
-        return r.json()
+        return self._json(r)
 
-    def get_timeseries(self, device, keys, start_ts=None, end_ts=None, limit=86400 * 10):
+    def get_timeseries(self, device, keys, start_ts=None, end_ts=None, limit=86400 * 10, long_format=False,
+                       dtype=np.float64, probe_empty=False):
         """Retrieve time series for a device in the desired interval.
 
         :param device: desired device
-        :param keys: data columns to download (empty string to get them all)
-        :param start_ts: interval start timestamp (in seconds)
-        :param end_ts: interval end timestamp (in seconds)
+        :param keys: data columns to download, either a list or an already
+                     comma separated string (empty string to get them all)
+        :param start_ts: interval start timestamp (integer, in milliseconds)
+        :param end_ts: interval end timestamp (integer, in milliseconds)
         :param limit: maximum number of rows to retrieve
-        :return: a pandas dataframe
+        :param long_format: return one (ts, key, value) row per data point
+                            instead of one column per key
+        :param dtype: numpy float type of the values, np.float32 halves memory.
+                      Keys with non numeric values are returned as text
+                      (the raw values), in long format numbers and text
+                      share an object column
+        :param probe_empty: first ask for a single point, and skip the full
+                            request if there's none. Saves a bulk request on
+                            empty intervals, costs one more on the others
+        :return: a pandas dataframe indexed by timestamp
         """
         entity_id = device['id']['id']
         entity_type = device['id']['entityType']
 
-        params={'keys': ','.join(keys),
+        if not isinstance(keys, str):
+            keys = ','.join(keys)
+
+        params={'keys': keys,
                 'limit': limit}
 
         if start_ts:
-            params.update({'startTs': int(start_ts * 1000)})
+            params.update({'startTs': start_ts})
         if end_ts:
-            params.update({'endTs': int(end_ts * 1000)})
+            params.update({'endTs': end_ts})
 
-        r = self._get(f'{self.url}/api/plugins/telemetry/{entity_type}/{entity_id}/values/timeseries',
-                      headers=self.auth_headers,
-                      params=params)
+        url = self._telemetry_url(entity_type, entity_id, 'values/timeseries')
 
-        if not r.json():
+        if probe_empty and not self._json(self._get(url, params={**params, 'limit': 1})):
             return None
 
-        dfs = []
-        for k in r.json().keys():
-            df = pd.DataFrame.from_dict(r.json()[k], dtype="float")
-            df.set_index("ts", drop=True, inplace=True)
-            df.index = df.index.astype(int)
-            df.columns = [k]
-            dfs.append(df.sort_index(ascending=True))
+        if self.stream_json and ijson is not None:
+            with self._get(url, params=params, stream=True) as r:
+                r.raw.decode_content = True
+                arrays = self._parse_timeseries(r.raw, dtype)
+        else:
+            data = self._json(self._get(url, params=params))
+            arrays = {}
+            for k, rows in data.items():
+                # fill typed arrays straight from the rows, no per-row dicts
+                ts = np.fromiter((row["ts"] for row in rows), dtype=np.int64, count=len(rows))
+                try:
+                    values = np.fromiter((row["value"] for row in rows), dtype=dtype, count=len(rows))
+                except (ValueError, TypeError):
+                    # not numeric (e.g. text telemetry), keep the raw
+                    # values as text
+                    values = _as_text(row["value"] for row in rows)
+                arrays[k] = (ts, values)
+
+        if not arrays:
+            return None
+
+        # one series per key, aligned and sorted once by a single
+        # concat instead of a dataframe + sort + outer join per key
+        series = {}
+        for k, (ts, values) in arrays.items():
+            # thingsboard returns the most recent points first, flipping
+            # the arrays is way cheaper than sorting them
+            if len(ts) > 1 and ts[0] > ts[-1]:
+                ts, values = ts[::-1], values[::-1]
+            series[k] = pd.Series(values, index=ts, name=k)
+
+        if long_format:
+            # stack the series as they are, sparse keys don't get padded
+            # with NaNs by the outer join of the wide format
+            values = [s.to_numpy() for s in series.values()]
+            if any(v.dtype == object for v in values):
+                # numbers and text: an object column where numbers stay
+                # numbers (of the requested dtype), so that writers format
+                # them just like in numeric chunks
+                values = np.fromiter(itertools.chain.from_iterable(values), dtype=object)
+            else:
+                values = np.concatenate(values)
+            df = pd.DataFrame({'key': np.repeat(list(series.keys()), [len(s) for s in series.values()]),
+                               'value': values},
+                              index=np.concatenate([s.index.to_numpy() for s in series.values()]))
+            # a single key is already in order
+            if len(series) > 1:
+                df = df.sort_index(kind="stable")
+            return df.rename_axis("ts")
+
+        indexes = [s.index for s in series.values()]
+        if all(index.equals(indexes[0]) for index in indexes[1:]):
+            # keys sampled together (or a single key): nothing to align,
+            # skip concat and its copy
+            df = pd.DataFrame({k: s.to_numpy() for k, s in series.items()}, index=indexes[0])
+        else:
+            # indexes are already increasing, so sort=True lets pandas
+            # merge them linearly and the final sort is just a check
+            df = pd.concat(series, axis=1, sort=True)
+
+        # only unordered responses need an actual sort
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
 
-        return pd.concat(dfs, join="outer", axis=1)
+        return df.rename_axis("ts")
+
+    def _parse_timeseries(self, fp, dtype):
+        """Stream-parse a timeseries response into per-key arrays.
+
+        Fill the arrays while the response is being received, without
+        ever building the whole json tree in memory. Needs ijson.
+
+        :param fp: file-like object with the response body
+        :param dtype: numpy float type of the values
+        :return: a dict of (timestamps, values) numpy arrays per key
+        """
+        ts = collections.defaultdict(lambda: array.array('q'))
+        values = collections.defaultdict(lambda: array.array('d'))
+        # how to write parsed numbers back as text if a later value of
+        # the same key is not numeric. One byte per value, the raw text
+        # is only kept when it's not just the number (e.g. "1.50")
+        forms = collections.defaultdict(lambda: array.array('b'))
+        raw = collections.defaultdict(dict)
+
+        # events for a {"key": [{"ts": ..., "value": ...}, ...]} body
+        # come with `key.item.ts` and `key.item.value` prefixes
+        for prefix, event, value in ijson.parse(fp, use_float=True):
+            if prefix.endswith('.item.ts'):
+                ts[prefix[:-len('.item.ts')]].append(value)
+            elif prefix.endswith('.item.value'):
+                k = prefix[:-len('.item.value')]
+                v = values[k]
+                if isinstance(v, array.array):
+                    try:
+                        # null is missing, like np.fromiter does
+                        number = np.nan if value is None else float(value)
+                    except (ValueError, TypeError):
+                        # not numeric, switch to the raw values as text
+                        # like the default parser does
+                        v = values[k] = _unparse(v, forms.pop(k, ()), raw.pop(k, {}))
+                    else:
+                        v.append(number)
+                        form = _number_form(value, number)
+                        forms[k].append(form)
+                        if form == _RAW:
+                            raw[k][len(v) - 1] = str(value)
+                        continue
+                v.append(None if value is None else str(value))
+
+        return {k: (np.frombuffer(ts[k], dtype=np.int64),
+                    np.asarray(values[k], dtype=dtype if isinstance(values[k], array.array) else object))
+                for k in ts}
 
     def get_timeseries_keys(self, device):
         """Get available timeseries column for a given device."""
         entity_id = device['id']['id']
         entity_type = device['id']['entityType']
-        r = self._get(f'{self.url}/api/plugins/telemetry/{entity_type}/{entity_id}/keys/timeseries',
-                      headers=self.auth_headers)
 
-        return r.json()
+        # keys are queried once per device
+        def fetch():
+            r = self._get(self._telemetry_url(entity_type, entity_id, 'keys/timeseries'))
+            return self._json(r)
+
+        # a copy, callers may change it
+        return list(self._cached_metadata(f'keys/{entity_type}/{entity_id}', fetch))
@@ -18,7 +18,9 @@
 #
 """Colored debug messages, rich styles, etc."""
 
+import re
 import argparse
+import threading
 from rich.console import Console
 from rich.highlighter import RegexHighlighter
 from rich.theme import Theme
@@ -27,13 +29,15 @@ from rich.theme import Theme
 class TBDownloadHighlighter(RegexHighlighter):
     """Style!."""
 
+    # compiled once here, rich would otherwise look them up in the re
+    # cache for every printed line
     base_style = "base."
-    highlights = [r"(?P<tag>^\s?[^:\s]+:)",
-                  r"(?P<true>True)",
-                  r"(?P<false>False)",
-                  r"(?P<date>\d+-\d+-\d+.\d+:\d+:\d+.[\d:]*)",
-                  r"(?P<path>`.+`)",
-                  ]
+    highlights = [re.compile(p) for p in (r"(?P<tag>^\s?[^:\s]+:)",
+                                          r"(?P<true>True)",
+                                          r"(?P<false>False)",
+                                          r"(?P<date>\d+-\d+-\d+.\d+:\d+:\d+.[\d:]*)",
+                                          r"(?P<path>`.+`)",
+                                          )]
 
 
 theme = Theme({"base.tag": "bold yellow",
@@ -42,42 +46,63 @@ theme = Theme({"base.tag": "bold yellow",
                "base.date": "italic cyan",
                "base.path": "bold italic orange1"
                })
-console = Console(highlighter=TBDownloadHighlighter(), theme=theme, markup=True)
+
+# consoles are only built when first used, e.g. a plain --help never
+# needs the main one. The lock makes sure concurrent downloads all get
+# the same console
+_consoles = {}
+_consoles_lock = threading.Lock()
+
+
+def _get_console(name, highlighter, theme):
+    console = _consoles.get(name)
+    if console is None:
+        with _consoles_lock:
+            console = _consoles.get(name)
+            if console is None:
+                console = _consoles[name] = Console(highlighter=highlighter(), theme=theme, markup=True)
+    return console
+
+
+def get_console():
+    """Return the console used for all messages, creating it if needed."""
+    return _get_console("main", TBDownloadHighlighter, theme)
 
 
 def print_exception(*args, **kwargs):  # noqa: D103
-    return console.print_exception(*args, **kwargs)
+    return get_console().print_exception(*args, **kwargs)
 
 
 def info(*args, **kwargs):  # noqa: D103
-    return console.print(*args, **kwargs)
+    return get_console().print(*args, **kwargs)
 
 
 def warning(*args, **kwargs):  # noqa: D103
-    return console.print(*args, **kwargs, style="orange1")
+    return get_console().print(*args, **kwargs, style="orange1")
 
 
 def error(*args, **kwargs):  # noqa: D103
-    return console.print(*args, **kwargs, style="red")
+    return get_console().print(*args, **kwargs, style="red")
 
 
 def rule(*args, **kwargs):  # noqa: D103
-    return console.rule(*args, **kwargs, style="purple")
+    return get_console().rule(*args, **kwargs, style="purple")
 
 
 class ArgParseHighlighter(RegexHighlighter):
     """Style for argparse help message."""
 
+    # precompiled like TBDownloadHighlighter ones
     base_style = "base."
-    highlights = [r"(?P<short>-\w)[^\w]",
-                  r"(?P<long>--[\w-]+)[^\w]",
-                  r"--[\w-]+\s(?P<longarg>[A-Z_]+)",
-                  r"-[\w]\s(?P<shortarg>[A-Z_]+)",
-                  r"(?P<usage>usage:)",
-                  r"(?P<default>default:)",
-                  r"\(default:\s(?P<value>.*)\)",
-                  r"^usage:\s(?P<cmd>[\w_-]+)"
-                  ]
+    highlights = [re.compile(p) for p in (r"(?P<short>-\w)[^\w]",
+                                          r"(?P<long>--[\w-]+)[^\w]",
+                                          r"--[\w-]+\s(?P<longarg>[A-Z_]+)",
+                                          r"-[\w]\s(?P<shortarg>[A-Z_]+)",
+                                          r"(?P<usage>usage:)",
+                                          r"(?P<default>default:)",
+                                          r"\(default:\s(?P<value>.*)\)",
+                                          r"^usage:\s(?P<cmd>[\w_-]+)"
+                                          )]
 
 
 argparse_theme = Theme({"base.short": "bold yellow",
@@ -89,12 +114,24 @@ argparse_theme = Theme({"base.short": "bold yellow",
                         "base.default": "orange1",
                         "base.value": "italic magenta",
                         })
-argparse_console = Console(highlighter=ArgParseHighlighter(),
-                           theme=argparse_theme, markup=True)
+
+
+def get_argparse_console():
+    """Return the console used for argparse messages, creating it if needed."""
+    return _get_console("argparse", ArgParseHighlighter, argparse_theme)
+
+
+def __getattr__(name):
+    # old module level consoles, now built on first access
+    if name == "console":
+        return get_console()
+    if name == "argparse_console":
+        return get_argparse_console()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class RichArgumentParser(argparse.ArgumentParser):
     """Apply rich styling to argparse messages."""
 
     def _print_message(self, message: str, file=None):
-        argparse_console.print(message)
+        get_argparse_console().print(message)
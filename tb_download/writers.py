@@ -0,0 +1,295 @@
+# Copyright (c) 2022 Filippo Argiolas <filippo.argiolas@ca.infn.it>.
+#
+# a simple script to download timeseries data from ThingsBoard
+# barely tested, poor error checking, ugly code, use at your own risk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Output formats for downloaded timeseries."""
+
+import io
+import os
+import csv
+import queue
+import threading
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pcsv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pc = None
+    pcsv = None
+    pq = None
+
+
+def _arrow_values(column):
+    """Return column values ready to be converted to an arrow array.
+
+    Numbers mixed with text in an object column (long format values of
+    chunks with text) are formatted by arrow, just like it formats them
+    in numeric columns, so each value is written the same way whatever
+    else is in its chunk.
+
+    :param column: dataframe column
+    """
+    values = column.to_numpy()
+    if values.dtype != object:
+        return values
+    missing = pd.isna(values)
+    numbers = ~missing & np.array([not isinstance(v, str) for v in values], dtype=bool)
+    values = values.copy()
+    if numbers.any():
+        # np.array keeps the float type of the numbers, e.g. float32
+        text = pc.cast(pa.array(np.array(list(values[numbers]))), pa.string())
+        values[numbers] = text.to_numpy(zero_copy_only=False)
+    values[missing] = None
+    return values
+
+
+def _is_text(type_):
+    return pa.types.is_string(type_) or pa.types.is_large_string(type_)
+
+
+def _promote(schema, other):
+    """Return `schema` with columns that are text in `other` made text too."""
+    fields = []
+    for field in schema:
+        other_type = other.field(field.name).type
+        if pa.types.is_null(field.type) or (_is_text(other_type) and not _is_text(field.type)):
+            field = field.with_type(other_type)
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+class CSVWriter(object):
+    """Write timeseries dataframes to a CSV file.
+
+    The file is opened with a large buffer and the header is written
+    once. Rows are serialized by the C csv module which is way faster
+    than `DataFrame.to_csv` on plain numeric data. Missing values are
+    written as empty fields, like pandas does.
+
+    :param filename: output filename
+    :param columns: data columns, the timestamp column is prepended
+    """
+
+    def __init__(self, filename, columns):
+        """Open the file and write the header."""
+        self.columns = columns
+        self.fh = open(filename, "w", buffering=1 << 20, newline="")
+        self.writer = csv.writer(self.fh, lineterminator="\n")
+        self.writer.writerow(["ts", *columns])
+
+    def write(self, df):
+        """Append dataframe rows to the file.
+
+        :param df: dataframe indexed by timestamp
+        """
+        columns = []
+        for c in self.columns:
+            values = df[c].to_numpy()
+            missing = pd.isna(values)
+            if values.dtype == np.float32:
+                # widening to python floats would print float64 digits,
+                # let numpy format the shortest float32 repr instead
+                values = values.astype(str)
+            values = values.astype(object)
+            values[missing] = None
+            columns.append(values)
+
+        self.writer.writerows(zip(df.index.tolist(), *columns))
+
+    def close(self):
+        """Close the file."""
+        self.fh.close()
+
+
+class ArrowCSVWriter(object):
+    """Write timeseries dataframes to a CSV file with pyarrow.
+
+    Same layout as `CSVWriter` but rows are serialized by the
+    multithreaded pyarrow CSV writer. Numbers are formatted by arrow
+    (e.g. `1` instead of `1.0`), also when mixed with text in long
+    format, and strings are always quoted. A single
+    arrow writer is reused as long as chunks keep the same schema, a
+    new one is set up if a column changes type (e.g. a key that is
+    numeric only in some of them).
+
+    :param filename: output filename
+    :param columns: data columns, the timestamp column is prepended
+    """
+
+    def __init__(self, filename, columns):
+        """Open the file and write the header."""
+        if pcsv is None:
+            raise ImportError("pyarrow is needed to write csv files with the pyarrow engine")
+        self.columns = columns
+        self.fh = open(filename, "wb", buffering=1 << 20)
+        # header is written here so that empty downloads get one too,
+        # quoted by the csv module like `CSVWriter` does
+        header = io.StringIO()
+        csv.writer(header, lineterminator="\n").writerow(["ts", *columns])
+        self.fh.write(header.getvalue().encode())
+        self.options = pcsv.WriteOptions(include_header=False, quoting_style="needed")
+        self.writer = None
+        self.schema = None
+
+    def write(self, df):
+        """Append dataframe rows to the file.
+
+        :param df: dataframe indexed by timestamp
+        """
+        arrays = [pa.array(df.index.to_numpy())]
+        arrays += [pa.array(_arrow_values(df[c]), from_pandas=True) for c in self.columns]
+        table = pa.Table.from_arrays(arrays, names=["ts", *self.columns])
+        if self.schema is None or not table.schema.equals(self.schema):
+            # flush and release the previous writer, closing an arrow
+            # writer leaves a python file it was given open
+            if self.writer is not None:
+                self.writer.close()
+            self.writer = pcsv.CSVWriter(self.fh, table.schema, write_options=self.options)
+            self.schema = table.schema
+        self.writer.write_table(table)
+
+    def close(self):
+        """Close the file."""
+        if self.writer is not None:
+            self.writer.close()
+        self.fh.close()
+
+
+class ParquetWriter(object):
+    """Write timeseries dataframes to a Parquet file.
+
+    Each dataframe is appended as a zstd compressed row group. Needs
+    pyarrow, the schema is taken from the first dataframe written. A
+    file has a single schema: if a numeric column turns to text in a
+    later dataframe (e.g. a key with text in some chunks only) what's
+    already written is rewritten with the column as text. Numbers are
+    formatted as text by arrow, like `ArrowCSVWriter` does.
+
+    :param filename: output filename
+    :param columns: data columns, the timestamp index is stored too
+    """
+
+    def __init__(self, filename, columns):
+        """Initialize class arguments, the file is created on first write."""
+        if pq is None:
+            raise ImportError("pyarrow is needed to write parquet files")
+        self.filename = filename
+        self.columns = columns
+        self.writer = None
+
+    def write(self, df):
+        """Append dataframe as a new row group.
+
+        :param df: dataframe indexed by timestamp
+        """
+        df = df[self.columns]
+        # numbers mixed with text can't be stored as is
+        mixed = {c: _arrow_values(df[c]) for c in self.columns if df[c].dtype == object}
+        if mixed:
+            df = df.assign(**mixed)
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.filename, table.schema, compression="zstd")
+        elif not table.schema.equals(self.writer.schema):
+            # e.g. a column with no data at all in this chunk, or text
+            # in a column that was numeric so far
+            schema = _promote(self.writer.schema, table.schema)
+            if not schema.equals(self.writer.schema):
+                self._rewrite(schema)
+            table = table.cast(schema)
+        self.writer.write_table(table)
+
+    def _rewrite(self, schema):
+        # at most once per column turning to text, row group by row
+        # group so the file is never loaded in memory as a whole
+        self.writer.close()
+        old = f"{self.filename}.tmp"
+        os.replace(self.filename, old)
+        self.writer = pq.ParquetWriter(self.filename, schema, compression="zstd")
+        with pq.ParquetFile(old) as source:
+            for i in range(source.num_row_groups):
+                self.writer.write_table(source.read_row_group(i).cast(schema))
+        os.remove(old)
+
+    def close(self):
+        """Finalize the file."""
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ThreadedWriter(object):
+    """Run another writer in a background thread.
+
+    Dataframes are handed over through a small bounded queue, so disk
+    writes overlap with downloading and parsing the next chunks while
+    memory usage stays bounded. Errors raised by the wrapped writer are
+    re-raised by the next `write` or by `close`.
+
+    :param writer: writer instance, e.g. `CSVWriter`
+    :param maxsize: maximum number of dataframes waiting to be written
+    """
+
+    def __init__(self, writer, maxsize=4):
+        """Start the writer thread."""
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            df = self.queue.get()
+            if df is None:
+                break
+            # after a failure keep draining the queue so that the
+            # producer never blocks on it
+            if self.error is not None:
+                continue
+            try:
+                self.writer.write(df)
+            except BaseException as e:
+                self.error = e
+
+    def write(self, df):
+        """Queue dataframe to be written.
+
+        :param df: dataframe indexed by timestamp
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(df)
+
+    def close(self):
+        """Wait for pending writes and close the wrapped writer."""
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
+
+
+writers = {"csv": CSVWriter,
+           "parquet": ParquetWriter}
+
+csv_engines = {"python": CSVWriter,
+               "pyarrow": ArrowCSVWriter}
@@ -0,0 +1,77 @@
+# Copyright (c) 2022 Filippo Argiolas <filippo.argiolas@ca.infn.it>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A fake ThingsBoard server, answering the client without any network."""
+
+import io
+import json
+from urllib.parse import urlparse
+
+import pytest
+
+from tb_download.client import TBDownload, ijson
+
+device = {'id': {'id': 'd0', 'entityType': 'DEVICE'}, 'name': 'dev'}
+
+
+class FakeResponse(object):
+    """Just enough of a requests response for the client."""
+
+    def __init__(self, body):
+        self.content = json.dumps(body).encode()
+        self.raw = io.BytesIO(self.content)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def fake_client(telemetry, stream=False, **kwargs):
+    """Return a client serving `telemetry`, a dict of {key: [(ts, value), ...]}.
+
+    Timeseries requests are answered like thingsboard does: points in
+    [startTs, endTs), at most `limit` per key, most recent first, keys
+    with no points left out.
+    """
+    client = TBDownload('http://tb.test', stream_json=stream, **kwargs)
+    client.requests = []
+
+    def get(url, params=None, **kwargs):
+        client.requests.append((urlparse(url).path, params))
+        if url.endswith('/keys/timeseries'):
+            return FakeResponse(list(telemetry))
+        if '/api/device/' in url:
+            return FakeResponse({**device, 'id': {**device['id'], 'id': url.rsplit('/', 1)[1]}})
+        body = {}
+        for k in params['keys'].split(','):
+            points = [(ts, v) for ts, v in telemetry.get(k, [])
+                      if params.get('startTs', 0) <= ts < params.get('endTs', float('inf'))]
+            points = sorted(points, reverse=True)[:params['limit']]
+            if points:
+                body[k] = [{'ts': ts, 'value': v} for ts, v in points]
+        return FakeResponse(body)
+
+    client._get = get
+    return client
+
+
+# run a test with both timeseries parsers
+parsers = pytest.mark.parametrize('stream', [
+    False, pytest.param(True, marks=pytest.mark.skipif(ijson is None, reason="needs ijson"))])
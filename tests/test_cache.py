@@ -0,0 +1,98 @@
+# Copyright (c) 2022 Filippo Argiolas <filippo.argiolas@ca.infn.it>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Chunk and metadata caches."""
+
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tb_download.cache import ChunkCache, MetadataCache, pq
+
+needs_pyarrow = pytest.mark.skipif(pq is None, reason="needs pyarrow")
+
+
+def frame(ts, **columns):
+    return pd.DataFrame(columns, index=pd.Index(ts, name='ts'))
+
+
+@needs_pyarrow
+def test_chunk_missing(tmp_path):
+    with pytest.raises(KeyError):
+        ChunkCache(str(tmp_path)).load(('url', 'd0', 1, 2))
+
+
+@needs_pyarrow
+def test_chunk_empty(tmp_path):
+    cache = ChunkCache(str(tmp_path))
+    cache.store(('url', 'd0', 1, 2), None)
+    assert cache.load(('url', 'd0', 1, 2)) is None
+
+
+@needs_pyarrow
+@pytest.mark.parametrize('df', [
+    frame([1, 2], a=np.array([1.5, np.nan], dtype=np.float32), t=pd.array(['on', None], dtype=object)),
+    frame([1, 2], key=['a', 'b'], value=[1.5, 2.5]),
+], ids=['wide', 'long'])
+def test_chunk_roundtrip(df, tmp_path):
+    cache = ChunkCache(str(tmp_path))
+    cache.store(('url', 'd0', 1, 2), df)
+    loaded = cache.load(('url', 'd0', 1, 2))
+
+    # text may come back as a string dtype, floats keep their precision
+    pd.testing.assert_frame_equal(loaded, df, check_dtype=False)
+    numeric = [c for c in df.columns if df[c].dtype.kind == 'f']
+    assert loaded[numeric].dtypes.tolist() == df[numeric].dtypes.tolist()
+
+
+@needs_pyarrow
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_chunk_mixed(dtype, tmp_path):
+    # long format values of a chunk with text: numbers keep their type
+    values = np.array([dtype(1.5), 'on', dtype(np.nan), None], dtype=object)
+    df = frame([1, 1, 2, 2], key=['a', 't', 'a', 't'], value=values)
+    cache = ChunkCache(str(tmp_path))
+    cache.store(('url', 'd0', 1, 2), df)
+
+    loaded = cache.load(('url', 'd0', 1, 2))
+    assert loaded.columns.tolist() == ['key', 'value']
+    assert loaded.index.tolist() == [1, 1, 2, 2]
+    assert [type(v) for v in loaded['value'][:2]] == [dtype, str]
+    assert loaded['value'][:2].tolist() == [1.5, 'on']
+    assert loaded['value'][2:].isna().all()
+
+
+def test_metadata(tmp_path):
+    filename = str(tmp_path / 'metadata.json')
+    cache = MetadataCache(filename)
+    with pytest.raises(KeyError):
+        cache.get('keys/d0')
+    cache.set('keys/d0', ['a', 'b'])
+
+    # persisted across instances
+    assert MetadataCache(filename).get('keys/d0') == ['a', 'b']
+
+    cache.clear()
+    with pytest.raises(KeyError):
+        MetadataCache(filename).get('keys/d0')
+
+
+def test_metadata_expired(tmp_path):
+    cache = MetadataCache(str(tmp_path / 'metadata.json'), ttl=60)
+    cache.entries['keys/d0'] = (time.time() - 120, ['a'])
+    with pytest.raises(KeyError):
+        cache.get('keys/d0')
@@ -0,0 +1,119 @@
+# Copyright (c) 2022 Filippo Argiolas <filippo.argiolas@ca.infn.it>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""get_timeseries with the default and the streaming parser."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tb_download.cache import MetadataCache
+from tb_download.client import ijson
+
+from conftest import device, fake_client, parsers
+
+telemetry = {
+    'num': [(1, '1.50'), (2, None), (3, '2.5')],
+    'txt': [(1, '1'), (2, 'x'), (3, None)],
+    'odd': [(1, 'nan'), (2, '1.50'), (3, 'on')],
+    'first': [(1, 3), (2, 'off')],
+}
+
+
+def get_timeseries(data, stream, **kwargs):
+    return fake_client(data, stream).get_timeseries(device, list(data), **kwargs)
+
+
+@parsers
+def test_text_keys(stream):
+    df = get_timeseries(telemetry, stream)
+
+    assert df.index.tolist() == [1, 2, 3]
+    assert df['num'].dtype == np.float64
+    assert df['num'].tolist()[::2] == [1.5, 2.5]
+    # raw values, not the numbers parsed before the text showed up
+    assert df['txt'].tolist()[:2] == ['1', 'x']
+    assert df['odd'].tolist() == ['nan', '1.50', 'on']
+    assert df['first'].tolist()[:2] == ['3', 'off']
+    assert df[['txt', 'first']].isna().sum().tolist() == [1, 1]
+
+
+@pytest.mark.skipif(ijson is None, reason="needs ijson")
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+@pytest.mark.parametrize('long_format', [False, True])
+def test_parsers_agree(long_format, dtype):
+    default = get_timeseries(telemetry, False, long_format=long_format, dtype=dtype)
+    stream = get_timeseries(telemetry, True, long_format=long_format, dtype=dtype)
+
+    pd.testing.assert_frame_equal(default, stream)
+    for c in default.columns:
+        assert [type(v) for v in default[c]] == [type(v) for v in stream[c]]
+
+
+@parsers
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_long_format_mixed(stream, dtype):
+    df = get_timeseries(telemetry, stream, long_format=True, dtype=dtype)
+
+    assert df.index.is_monotonic_increasing
+    num = df.loc[df['key'] == 'num', 'value'].tolist()
+    # numbers stay numbers of the requested dtype, next to the text
+    assert [type(v) for v in num[::2]] == [dtype, dtype]
+    assert df.loc[df['key'] == 'txt', 'value'].tolist()[:2] == ['1', 'x']
+
+
+@parsers
+def test_numeric(stream):
+    df = get_timeseries({'a': [(1, '1'), (2, '2')], 'b': [(3, '3')]}, stream, dtype=np.float32)
+
+    assert (df.dtypes == np.float32).all()
+    assert df.index.tolist() == [1, 2, 3]
+    assert df['b'].isna().tolist() == [True, True, False]
+
+
+@parsers
+def test_empty(stream):
+    assert get_timeseries({}, stream) is None
+
+
+def test_metadata_memoized():
+    client = fake_client(telemetry)
+    other = fake_client(telemetry)
+
+    assert client.get_timeseries_keys(device) == list(telemetry)
+    assert client.get_device('d1')['id']['id'] == 'd1'
+    client.get_timeseries_keys(device)
+    client.get_device('d1')
+    assert len(client.requests) == 2
+
+    # each client has its own
+    other.get_timeseries_keys(device)
+    assert len(other.requests) == 1
+    other.clear_metadata_cache()
+    client.get_timeseries_keys(device)
+    assert len(client.requests) == 2
+
+    client.clear_metadata_cache()
+    client.get_timeseries_keys(device)
+    assert len(client.requests) == 3
+
+
+def test_metadata_persisted(tmp_path):
+    filename = str(tmp_path / 'metadata.json')
+    fake_client(telemetry, metadata=MetadataCache(filename)).get_timeseries_keys(device)
+
+    second = fake_client(telemetry, metadata=MetadataCache(filename))
+    assert second.get_timeseries_keys(device) == list(telemetry)
+    assert second.requests == []
@@ -0,0 +1,172 @@
+# Copyright (c) 2022 Filippo Argiolas <filippo.argiolas@ca.infn.it>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""save_timeseries from the tb-download script, against a fake server."""
+
+import os
+import datetime as dt
+import importlib.util
+import importlib.machinery
+
+import numpy as np
+import pandas as pd
+import pytest
+from rich.progress import Progress
+
+from tb_download.cache import ChunkCache
+from tb_download.writers import pa
+
+from conftest import device, fake_client, parsers
+
+script = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'tb-download')
+loader = importlib.machinery.SourceFileLoader('tb_download_script', script)
+tb_download_script = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+loader.exec_module(tb_download_script)
+
+needs_pyarrow = pytest.mark.skipif(pa is None, reason="needs pyarrow")
+
+start = dt.datetime(2023, 1, 1)
+end = dt.datetime(2023, 1, 5)
+hour = 3600 * 1000
+t0 = round(start.timestamp() * 1000)
+
+
+def telemetry(text_day=None):
+    """Four days of hourly data, `txt` holds text on `text_day` only."""
+    points = range(4 * 24)
+    return {
+        'num': [(t0 + i * hour, str(i / 4)) for i in points],
+        'txt': [(t0 + i * hour, 'on' if i // 24 == text_day else str(i % 3)) for i in points if i % 2],
+    }
+
+
+def save(client, filename, **kwargs):
+    with Progress(disable=True) as progress:
+        tb_download_script.save_timeseries(client, device, start, end, progress, filename=str(filename),
+                                           concurrency=2, **kwargs)
+
+
+def read(filename, file_format):
+    if file_format == 'parquet':
+        return pd.read_parquet(filename)
+    return pd.read_csv(filename, index_col='ts', dtype={'txt': str, 'key': str, 'value': str})
+
+
+outputs = pytest.mark.parametrize('file_format,csv_engine', [
+    ('csv', 'python'),
+    pytest.param('csv', 'pyarrow', marks=needs_pyarrow),
+    pytest.param('parquet', 'python', marks=needs_pyarrow)])
+
+
+@parsers
+@outputs
+@pytest.mark.parametrize('text_day', [0, 2])
+def test_wide(stream, file_format, csv_engine, text_day, tmp_path):
+    filename = tmp_path / 'out'
+    save(fake_client(telemetry(text_day), stream), filename, file_format=file_format, csv_engine=csv_engine)
+
+    df = read(filename, file_format)
+    assert df.index.tolist() == [t0 + i * hour for i in range(4 * 24)]
+    assert np.allclose(df['num'], np.arange(4 * 24) / 4)
+    txt = df['txt'].dropna()
+    assert len(txt) == 2 * 24
+    assert (txt[txt.index < t0 + (text_day + 1) * 24 * hour].tail(12) == 'on').all()
+    assert set(txt[txt != 'on'].astype(float)) == {0, 1, 2}
+
+
+@parsers
+@outputs
+@pytest.mark.parametrize('text_day', [0, 2])
+def test_long(stream, file_format, csv_engine, text_day, tmp_path):
+    filename = tmp_path / 'out'
+    save(fake_client(telemetry(text_day), stream), filename, file_format=file_format, csv_engine=csv_engine,
+         long_format=True)
+
+    df = read(filename, file_format)
+    assert df.index.is_monotonic_increasing
+    assert df['key'].value_counts().to_dict() == {'num': 4 * 24, 'txt': 2 * 24}
+    num = df.loc[df['key'] == 'num', 'value'].astype(float)
+    assert num.tolist() == (np.arange(4 * 24) / 4).tolist()
+    # whole numbers are written the same way (1 or 1.0, depending on
+    # the writer) in chunks with and without text
+    whole = df.loc[df['key'] == 'num', 'value'][::4]
+    assert whole.str.contains('.', regex=False).nunique() == 1
+    assert (df.loc[df['key'] == 'txt', 'value'] == 'on').sum() == 12
+
+
+@pytest.mark.parametrize('long_format', [False, True])
+@pytest.mark.parametrize('float32', [False, True])
+def test_parsers_agree(long_format, float32, tmp_path):
+    pytest.importorskip('ijson')
+    for stream in (False, True):
+        save(fake_client(telemetry(1), stream), tmp_path / f'out{stream}', long_format=long_format, float32=float32)
+    assert (tmp_path / 'outFalse').read_text() == (tmp_path / 'outTrue').read_text()
+
+
+def test_limit_splits_chunks(tmp_path):
+    client = fake_client(telemetry())
+    save(client, tmp_path / 'out', delta=dt.timedelta(days=2), limit=10)
+    save(fake_client(telemetry()), tmp_path / 'ref')
+
+    assert (tmp_path / 'out').read_text() == (tmp_path / 'ref').read_text()
+    assert len(client.requests) > 2 * 4 * 24 / 10
+
+
+def test_adaptive(tmp_path):
+    client = fake_client(telemetry())
+    save(client, tmp_path / 'out', delta=dt.timedelta(hours=1), adaptive=True)
+    save(fake_client(telemetry()), tmp_path / 'ref')
+
+    assert (tmp_path / 'out').read_text() == (tmp_path / 'ref').read_text()
+    # chunks grew instead of asking for an hour at the time
+    assert len(client.requests) < 4 * 24 / 2
+
+
+def test_skip_empty(tmp_path):
+    data = {'num': [(t0 + i * hour, '1') for i in range(24)]}
+    client = fake_client(data)
+    with Progress(disable=True) as progress:
+        tb_download_script.save_timeseries(client, device, start, start + dt.timedelta(days=30), progress,
+                                           filename=str(tmp_path / 'out'), skip_empty=True)
+
+    assert len(pd.read_csv(tmp_path / 'out')) == 24
+    # a probe per week, then the chunks of the first week only
+    assert len(client.requests) <= 1 + 5 + 7
+
+
+@needs_pyarrow
+@pytest.mark.parametrize('long_format', [False, True])
+def test_cache(long_format, tmp_path):
+    cache = ChunkCache(str(tmp_path / 'cache'))
+    save(fake_client(telemetry(1)), tmp_path / 'first', long_format=long_format, cache=cache)
+
+    client = fake_client(telemetry(1))
+    save(client, tmp_path / 'second', long_format=long_format, cache=cache)
+
+    # only the keys are asked again
+    assert [path for path, params in client.requests if 'values' in path] == []
+    assert (tmp_path / 'first').read_text() == (tmp_path / 'second').read_text()
+
+
+@parsers
+@pytest.mark.parametrize('buffered', [False, True])
+def test_missing_key(stream, buffered, tmp_path):
+    # a key with no data at all gets an empty column
+    data = {**telemetry(1), 'none': []}
+    save(fake_client(data, stream), tmp_path / 'out', buffered=buffered)
+
+    df = pd.read_csv(tmp_path / 'out', index_col='ts')
+    assert df.columns.tolist() == ['num', 'txt', 'none']
+    assert df['none'].isna().all()
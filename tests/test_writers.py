@@ -0,0 +1,164 @@
+# Copyright (c) 2022 Filippo Argiolas <filippo.argiolas@ca.infn.it>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Writers, in particular columns changing type from a chunk to another."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import tb_download.writers
+from tb_download.writers import CSVWriter, ArrowCSVWriter, ParquetWriter, ThreadedWriter, pa, pq
+
+needs_pyarrow = pytest.mark.skipif(pa is None, reason="needs pyarrow")
+
+writers = pytest.mark.parametrize('writer_class', [
+    CSVWriter,
+    pytest.param(ArrowCSVWriter, marks=needs_pyarrow),
+    pytest.param(ParquetWriter, marks=needs_pyarrow)])
+
+
+def frame(ts, **columns):
+    return pd.DataFrame(columns, index=pd.Index(ts, name='ts'))
+
+
+def text(values):
+    return np.array(values, dtype=object)
+
+
+def write(writer, filename, columns, *frames):
+    w = writer(str(filename), columns)
+    for df in frames:
+        w.write(df)
+    w.close()
+
+
+def read(writer, filename):
+    """Read back a file as text, missing values as None."""
+    if writer is ParquetWriter:
+        df = pd.read_parquet(filename)
+        return {c: [None if pd.isna(v) else str(v) for v in df[c]] for c in df.columns}
+    df = pd.read_csv(filename, index_col='ts', dtype=str, keep_default_na=False)
+    return {c: [v or None for v in df[c]] for c in df.columns}
+
+
+def read_numbers(writer, filename):
+    if writer is ParquetWriter:
+        return pd.read_parquet(filename)
+    return pd.read_csv(filename, index_col='ts')
+
+
+# how each writer formats 3.0 and 0.1, in single or double precision
+numbers = {CSVWriter: ('3.0', '0.1'), ArrowCSVWriter: ('3', '0.1'), ParquetWriter: ('3', '0.1')}
+
+
+@writers
+def test_numeric(writer_class, tmp_path):
+    filename = tmp_path / 'out'
+    write(writer_class, filename, ['a', 'b'],
+          frame([1, 2], a=[1.5, np.nan], b=[3.0, 4.0]),
+          frame([3], a=[2.5], b=[5.0]))
+
+    df = read_numbers(writer_class, filename)
+    assert df.index.tolist() == [1, 2, 3]
+    assert df['a'].tolist()[::2] == [1.5, 2.5]
+    assert df['a'].isna().tolist() == [False, True, False]
+    assert df['b'].tolist() == [3.0, 4.0, 5.0]
+
+
+@writers
+@pytest.mark.parametrize('text_first', [False, True])
+def test_key_turning_text(writer_class, text_first, tmp_path):
+    # numbers in a chunk, text (and a missing value) in another
+    chunks = [frame([1, 2], a=[1.0, 2.0], t=[3.0, np.nan]),
+              frame([3, 4], a=[3.0, 4.0], t=pd.array(['on', None], dtype=object))]
+    if text_first:
+        chunks = [df.set_axis(df.index + 10 * i, axis=0) for i, df in enumerate(reversed(chunks))]
+    filename = tmp_path / 'out'
+    write(writer_class, filename, ['a', 't'], *chunks)
+
+    three = numbers[writer_class][0]
+    t = read(writer_class, filename)['t']
+    assert t == (['on', None, three, None] if text_first else [three, None, 'on', None])
+
+
+@writers
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_long_format_mixed(writer_class, dtype, tmp_path):
+    # numbers of numeric keys next to text, like get_timeseries returns
+    # them in long format
+    numeric = frame([1, 1], key=['a', 't'], value=np.array([3.0, 0.1], dtype=dtype))
+    mixed = frame([2, 2, 3], key=['a', 't', 'a'],
+                  value=text([dtype(3.0), 'on', dtype(np.nan)]))
+    filename = tmp_path / 'out'
+    write(writer_class, filename, ['key', 'value'], numeric, mixed, numeric.set_axis(numeric.index + 3, axis=0))
+
+    three, tenth = numbers[writer_class]
+    # the same number is written the same way with or without text in
+    # its chunk
+    assert read(writer_class, filename)['value'] == [three, tenth, three, 'on', None, three, tenth]
+
+
+@needs_pyarrow
+def test_parquet_promotion_keeps_row_groups(tmp_path):
+    filename = tmp_path / 'out.parquet'
+    write(ParquetWriter, filename, ['t'],
+          frame([1], t=[1.0]), frame([2], t=[2.0]), frame([3], t=text(['on'])), frame([4], t=[4.0]))
+
+    assert pq.ParquetFile(filename).num_row_groups == 4
+    assert pd.read_parquet(filename)['t'].tolist() == ['1', '2', 'on', '4']
+    assert not (tmp_path / 'out.parquet.tmp').exists()
+
+
+@writers
+def test_threaded(writer_class, tmp_path):
+    filename = tmp_path / 'out'
+    writer = ThreadedWriter(writer_class(str(filename), ['a']), maxsize=1)
+    for i in range(10):
+        writer.write(frame([i], a=[float(i)]))
+    writer.close()
+
+    assert read_numbers(writer_class, filename)['a'].tolist() == list(range(10))
+
+
+def test_threaded_error(tmp_path):
+    writer = ThreadedWriter(CSVWriter(str(tmp_path / 'out'), ['a']))
+    writer.write(frame([1], b=[1.0]))
+    with pytest.raises(KeyError):
+        writer.close()
+
+
+@needs_pyarrow
+def test_arrow_csv_schema_change(tmp_path, monkeypatch):
+    opened = []
+
+    class CSVWriter(tb_download.writers.pcsv.CSVWriter):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            opened.append(self)
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    monkeypatch.setattr(tb_download.writers.pcsv, 'CSVWriter', CSVWriter)
+    filename = tmp_path / 'out.csv'
+    write(ArrowCSVWriter, filename, ['t'], frame([1], t=[1.0]), frame([2], t=text(['on'])), frame([3], t=[3.0]))
+
+    # a writer per schema change, each one closed before the next
+    assert len(opened) == 3
+    assert all(w.closed for w in opened)
+    assert read(ArrowCSVWriter, filename)['t'] == ['1', 'on', '3']